@@ -1,12 +1,21 @@
 """LangGraph agent orchestration system for context-aware chatbot."""
 
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
 from typing import TypedDict, Sequence, Literal
 
+import httpx
+import ollama
+from cachetools import TTLCache
 from langchain.schema import HumanMessage, AIMessage
-from langchain_community.llms import Ollama
 from langgraph.graph import StateGraph, END
 
-from config import OLLAMA_MODEL, OLLAMA_BASE_URL
+from config import OLLAMA_MODEL, OLLAMA_BASE_URL, MAX_HISTORY_TURNS
+from retrieval import retrieve_relevant_info
 from tools import (
     validate_name,
     validate_phone,
@@ -15,43 +24,166 @@ from tools import (
     query_documents
 )
 
-# Initialize Ollama LLM
-llm = Ollama(
-    model=OLLAMA_MODEL,
-    base_url=OLLAMA_BASE_URL,
-    temperature=0.7
-)
+logger = logging.getLogger(__name__)
+
+# One Ollama client per event loop. The keep-alive connection pool
+# amortizes TCP handshakes that the langchain wrapper paid per call, but
+# pooled connections are bound to the loop that created them — a single
+# module-level client breaks CLI entry points, where each asyncio.run call
+# spins up (and closes) a fresh loop. Under uvicorn there is one long-lived
+# loop, so this still means one client per process.
+_clients_by_loop = {}
+
+
+def _get_ollama_client() -> ollama.AsyncClient:
+    """Return the Ollama client for the running event loop, creating it once."""
+    loop = asyncio.get_running_loop()
+    client = _clients_by_loop.get(loop)
+    if client is None:
+        # Drop clients whose loops have closed (CLI runs create a loop per call)
+        for stale in [l for l in _clients_by_loop if l.is_closed()]:
+            del _clients_by_loop[stale]
+        client = ollama.AsyncClient(
+            host=OLLAMA_BASE_URL,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        _clients_by_loop[loop] = client
+    return client
+
+
+async def _agenerate(prompt: str, temperature: float = 0.7) -> str:
+    """Generate a completion on the shared Ollama client."""
+    result = await _get_ollama_client().generate(
+        model=OLLAMA_MODEL, prompt=prompt, options={"temperature": temperature}
+    )
+    return result["response"]
+
+
+async def _astream(prompt: str, temperature: float = 0.7):
+    """Stream a completion chunk by chunk on the shared Ollama client."""
+    async for part in await _get_ollama_client().generate(
+            model=OLLAMA_MODEL, prompt=prompt, stream=True,
+            options={"temperature": temperature}):
+        yield part["response"]
+
+
+async def aclose_llm_client():
+    """Close this loop's Ollama HTTP client (called on app shutdown)."""
+    client = _clients_by_loop.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        # ollama 0.1.x exposes no public close; reach into the httpx client
+        await client._client.aclose()
+
+
+# Compiled once at import so the regex engine never re-parses the patterns
+PHONE_RE = re.compile(r'[\+\(]?[0-9][0-9\s\-\(\)]{8,}[0-9]')
+EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+
+
+# Caches for LLM-derived results keyed by normalized message text.
+# Identical messages (common in tests and client reconnects) skip the
+# Ollama round trip entirely; entries expire after 15 minutes.
+_intent_cache = TTLCache(maxsize=1024, ttl=900)
+_extraction_cache = TTLCache(maxsize=1024, ttl=900)
+
+
+# Booking form fields and the confirmation message, pre-formatted once
+REQUIRED_FIELDS = ("name", "phone", "email", "date")
+
+CONFIRMATION_TMPL = """Great! I have all the information needed for your appointment:
+    Name: {name}
+    Phone: {phone}
+    Email: {email}
+    Date: {date}
+
+    Your appointment has been successfully booked! You will receive a confirmation email shortly.
+"""
+
+
+# Keyword heuristics for the intent fast path (skips the LLM on obvious inputs)
+APPOINTMENT_KEYWORDS = ["appointment", "book", "schedule", "reservation", "meeting"]
+QUERY_KEYWORDS = ["what", "how", "why", "when", "tell me", "price", "cost", "hours"]
+
+
+# Prompts are laid out with the static instructions first and the variable
+# content (user input, documents) last, so Ollama sees identical leading
+# tokens across turns and can reuse its KV cache for the shared prefix.
+
+# Intent classification prompt prefix (static across all turns)
+INTENT_PROMPT_PREFIX = """You are an expert intent classifier. Classify the user's input into one of these categories:
+    - "appointment_booking": If the user wants to book an appointment, schedule, make a reservation, or provide booking details
+    - "document_query": If the user is asking questions about documents, information, or general queries
+
+Respond with only one word: either "appointment_booking" or "document_query".
+
+User input: """
+
+# Document-answering prompt prefix (static across all turns)
+DOC_PROMPT_PREFIX = """You are a helpful assistant. Answer the user's question based on the document information below.
+Provide a clear and concise answer. If the information is not available in the documents, say so politely.
+
+"""
+
+
+# Structured extraction prompt: pulls all booking fields in a single LLM call
+EXTRACT_PROMPT = """
+Extract the following fields from the user's message. Respond with ONLY a JSON object,
+no explanations or commentary:
+{{"name": "<full name or null>", "phone": "<phone number or null>", "email": "<email address or null>", "date": "<date phrase or null>"}}
+
+Use null for any field that is not present in the message.
+
+Message: "{text}"
+JSON:
+"""
 
 
 # Define the state for our agent
 class AgentState(TypedDict):
+    # Conversation history deliberately stays out of the graph state: no node
+    # reads it, and carrying it would bloat every state dict passed between nodes
     messages: Sequence[HumanMessage | AIMessage]
     user_input: str
     intent: str  # "document_query" or "appointment_booking"
     appointment_data: dict
-    conversation_history: list
     documents_content: str
     response: str
     next_action: str
 
 
-def classify_intent(state: AgentState) -> AgentState:
+async def classify_intent(state: AgentState) -> AgentState:
     """Classify user intent as document query or appointment booking."""
     user_input = state["user_input"].lower()
 
-    # Intent classification prompt
-    prompt = f"""
-    You are an expert intent classifier. Classify the user's input into one of these categories:
-        - "appointment_booking": If the user wants to book an appointment, schedule, make a reservation, or provide booking details
-        - "document_query": If the user is asking questions about documents, information, or general queries
-        
-        User input: "{state['user_input']}"
-        
-        Respond with only one word: either "appointment_booking" or "document_query".
-    """
+    # Mid-booking shortcut: inputs during an incomplete booking stay in the
+    # booking flow without an LLM call. This must run before the keyword
+    # heuristic — replies like "how about tomorrow" contain query keywords
+    # and would otherwise be yanked out of the form mid-fill.
+    appointment_data = state.get("appointment_data", {})
+    if appointment_data and not all(
+            appointment_data.get(field) for field in REQUIRED_FIELDS):
+        state["intent"] = "appointment_booking"
+        return state
+
+    # Keyword fast path: skip the LLM round trip when exactly one category matches
+    is_appointment = any(keyword in user_input for keyword in APPOINTMENT_KEYWORDS)
+    is_query = any(keyword in user_input for keyword in QUERY_KEYWORDS)
+    if is_appointment != is_query:
+        state["intent"] = "appointment_booking" if is_appointment else "document_query"
+        return state
+
+    # Cached LLM classification for repeated messages
+    cache_key = user_input.strip()
+    cached_intent = _intent_cache.get(cache_key)
+    if cached_intent:
+        state["intent"] = cached_intent
+        return state
+
+    # Static prefix first, user input last, so the KV-cache prefix can hit
+    prompt = f'{INTENT_PROMPT_PREFIX}"{state["user_input"]}"'
 
     try:
-        intent_response = llm.invoke(prompt).strip().lower()
+        intent_response = (await _agenerate(prompt)).strip().lower()
 
         # Parse the response
         if "appointment" in intent_response or "booking" in intent_response:
@@ -60,39 +192,72 @@ def classify_intent(state: AgentState) -> AgentState:
             state["intent"] = "document_query"
         else:
             # Default fallback: check keywords in user input
-            appointment_keywords = ["appointment", "book", "schedule", "reservation", "meeting"]
-            if any(keyword in user_input for keyword in appointment_keywords):
+            if any(keyword in user_input for keyword in APPOINTMENT_KEYWORDS):
                 state["intent"] = "appointment_booking"
             else:
                 state["intent"] = "document_query"
-    except Exception as e:
-        print(f"Intent classification error: {e}")
+
+        _intent_cache[cache_key] = state["intent"]
+    except Exception:
+        logger.exception("Intent classification error")
         # Default to document query
         state["intent"] = "document_query"
 
     return state
 
 
-def handle_document_query(state: AgentState) -> AgentState:
+def build_doc_prompt(user_query: str, relevant_info: str) -> str:
+    """Build the document-answering prompt (shared with the streaming endpoint)."""
+    return f"{DOC_PROMPT_PREFIX}Document Information:\n{relevant_info}\n\nUser Question: {user_query}\n"
+
+
+def _relevant_info(user_query: str, documents_content: str) -> str:
+    """Retrieve relevant document chunks via the embedding index.
+
+    Falls back to the LLM-extraction path in query_documents when the
+    embedding endpoint is unavailable.
+    """
+    if not documents_content:
+        return query_documents(user_query, documents_content)
+    try:
+        return retrieve_relevant_info(user_query, documents_content)
+    except Exception:
+        logger.warning("Embedding retrieval failed, falling back to LLM extraction",
+                       exc_info=True)
+        return query_documents(user_query, documents_content)
+
+
+async def _arelevant_info(user_query: str, documents_content: str) -> str:
+    """Async wrapper for _relevant_info.
+
+    The embedding POST (and its query_documents fallback) are blocking
+    requests-based calls; running them in a worker thread keeps the event
+    loop free for concurrent requests.
+    """
+    return await asyncio.to_thread(_relevant_info, user_query, documents_content)
+
+
+async def astream_document_answer(user_query: str, documents_content: str):
+    """Stream a document-query answer token by token."""
+    relevant_info = await _arelevant_info(user_query, documents_content)
+    prompt = build_doc_prompt(user_query, relevant_info)
+    async for chunk in _astream(prompt):
+        yield chunk
+
+
+async def handle_document_query(state: AgentState) -> AgentState:
     """Handle document query using Ollama and document search."""
     user_query = state["user_input"]
     documents_content = state.get("documents_content", "")
 
-    # Query documents
-    relevant_info = query_documents(user_query, documents_content)
+    # Retrieve the relevant document chunks
+    relevant_info = await _arelevant_info(user_query, documents_content)
 
     # Generate response using LLM
-    prompt = f"""You are a helpful assistant. Answer the user's question based on the following document information.
-        Document Information:
-        {relevant_info}
-        
-        User Question: {user_query}
-        
-        Provide a clear and concise answer. If the information is not available in the documents, say so politely.
-"""
+    prompt = build_doc_prompt(user_query, relevant_info)
 
     try:
-        response = llm.invoke(prompt)
+        response = await _agenerate(prompt)
         state["response"] = response
     except Exception as e:
         state["response"] = f"I apologize, but I encountered an error: {str(e)}"
@@ -101,89 +266,95 @@ def handle_document_query(state: AgentState) -> AgentState:
     return state
 
 
-def handle_appointment_booking(state: AgentState) -> AgentState:
+async def handle_appointment_booking(state: AgentState) -> AgentState:
     """Handle appointment booking with conversational form filling."""
-    user_input = state["user_input"]
     appointment_data = state.get("appointment_data", {})
 
-    # Check what fields are missing
-    required_fields = ["name", "phone", "email", "date"]
-    missing_fields = [field for field in required_fields if
-                      field not in appointment_data or not appointment_data[field]]
-
+    # Fast path: booking already complete, no extraction or LLM work needed
+    missing_fields = [field for field in REQUIRED_FIELDS if not appointment_data.get(field)]
     if not missing_fields:
-        # All fields collected, confirm booking
-        state["response"] = f"""Great! I have all the information needed for your appointment:
-            Name: {appointment_data['name']}
-            Phone: {appointment_data['phone']}
-            Email: {appointment_data['email']}
-            Date: {appointment_data['date']}
-            
-            Your appointment has been successfully booked! You will receive a confirmation email shortly.
-        """
+        state["response"] = CONFIRMATION_TMPL.format_map(appointment_data)
         state["next_action"] = "complete"
         return state
 
-    # Try to extract information from user input
+    user_input = state["user_input"]
+
+    # Kick off the structured LLM extraction (one call for all missing
+    # fields), reusing a cached result when the same message was seen recently
+    cache_key = user_input.strip().lower()
+    extracted = _extraction_cache.get(cache_key)
+    extraction_task = None
+    if extracted is None:
+        extraction_task = asyncio.create_task(
+            _agenerate(EXTRACT_PROMPT.format(text=user_input))
+        )
+
+    # Run the cheap CPU-bound extraction while the Ollama call is in flight,
+    # so the LLM round trip is the only wall-clock cost of this turn
+    phone_matches = PHONE_RE.findall(user_input) if "phone" in missing_fields else []
+    email_matches = EMAIL_RE.findall(user_input) if "email" in missing_fields else []
+    date_result = (extract_date_from_natural_language(user_input)
+                   if "date" in missing_fields else {"valid": False})
+
+    if extraction_task is not None:
+        extracted = {}
+        try:
+            raw = (await extraction_task).strip()
+            parsed = json.loads(raw)
+            if isinstance(parsed, dict):
+                # Drop empty fields and literal "null" strings from the model
+                extracted = {k: v for k, v in parsed.items() if v and str(v).lower() != "null"}
+            _extraction_cache[cache_key] = extracted
+        except Exception:
+            # Fall back to the regex results below
+            logger.warning("Structured extraction failed, falling back to regex",
+                           exc_info=True)
+
     response_parts = []
 
     # Check for name
-    if "name" not in appointment_data or not appointment_data["name"]:
-        # Try to extract name using LLM
-        name_prompt = f"""
-        Extract the person's name from this text. If no name is present, respond with "NOT_FOUND".
-        Text: "{user_input}"
-        Name:
-        """
-        try:
-            extracted_name = llm.invoke(name_prompt).strip()
-            if extracted_name != "NOT_FOUND" and len(extracted_name) > 0:
-                validation = validate_name(extracted_name)
-                if validation["valid"]:
-                    appointment_data["name"] = validation["value"]
-                    response_parts.append(f"Got it! I've recorded your name as {validation['value']}.")
-        except:
-            pass
-
-    # Check for phone
-    if "phone" not in appointment_data or not appointment_data["phone"]:
-        # Look for phone patterns
-        import re
-        phone_pattern = r'[\+\(]?[0-9][0-9\s\-\(\)]{8,}[0-9]'
-        phone_matches = re.findall(phone_pattern, user_input)
-        if phone_matches:
-            validation = validate_phone(phone_matches[0])
+    if "name" in missing_fields:
+        extracted_name = extracted.get("name")
+        if extracted_name:
+            validation = validate_name(str(extracted_name))
+            if validation["valid"]:
+                appointment_data["name"] = validation["value"]
+                missing_fields.remove("name")
+                response_parts.append(f"Got it! I've recorded your name as {validation['value']}.")
+
+    # Check for phone: prefer the deterministic regex hit, then the LLM
+    if "phone" in missing_fields:
+        candidate = phone_matches[0] if phone_matches else extracted.get("phone")
+        if candidate:
+            validation = validate_phone(str(candidate))
             if validation["valid"]:
                 appointment_data["phone"] = validation["value"]
+                missing_fields.remove("phone")
                 response_parts.append(f"Phone number recorded: {validation['value']}")
 
-    # Check for email
-    if "email" not in appointment_data or not appointment_data["email"]:
-        # Look for email patterns
-        import re
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        email_matches = re.findall(email_pattern, user_input)
-        if email_matches:
-            validation = validate_email_address(email_matches[0])
+    # Check for email: prefer the deterministic regex hit, then the LLM
+    if "email" in missing_fields:
+        candidate = email_matches[0] if email_matches else extracted.get("email")
+        if candidate:
+            validation = validate_email_address(str(candidate))
             if validation["valid"]:
                 appointment_data["email"] = validation["value"]
+                missing_fields.remove("email")
                 response_parts.append(f"Email recorded: {validation['value']}")
 
-    # Check for date
-    if "date" not in appointment_data or not appointment_data["date"]:
-        # Try to extract date
-        date_result = extract_date_from_natural_language(user_input)
+    # Check for date: the raw-input parse already ran; fall back to the
+    # LLM-extracted date phrase if it failed
+    if "date" in missing_fields:
+        if not date_result["valid"] and extracted.get("date"):
+            date_result = extract_date_from_natural_language(str(extracted["date"]))
         if date_result["valid"]:
             appointment_data["date"] = date_result["value"]
+            missing_fields.remove("date")
             response_parts.append(f"Date recorded: {date_result.get('parsed_date', date_result['value'])}")
 
     # Update state
     state["appointment_data"] = appointment_data
 
-    # Check again for missing fields
-    missing_fields = [field for field in required_fields if
-                      field not in appointment_data or not appointment_data[field]]
-
     if response_parts:
         response = "\n".join(response_parts) + "\n\n"
     else:
@@ -203,15 +374,7 @@ def handle_appointment_booking(state: AgentState) -> AgentState:
         state["next_action"] = "continue"
     else:
         # All fields collected
-        response = f"""Perfect! I have all the information needed:
-
-        Name: {appointment_data['name']}
-        Phone: {appointment_data['phone']}
-        Email: {appointment_data['email']}
-        Date: {appointment_data['date']}
-        
-        Your appointment has been successfully booked!
-        """
+        response = CONFIRMATION_TMPL.format_map(appointment_data)
         state["next_action"] = "complete"
 
     state["response"] = response
@@ -224,8 +387,9 @@ def route_intent(state: AgentState) -> Literal["document_query", "appointment_bo
 
 
 # Build the LangGraph
+@functools.cache
 def create_agent_graph():
-    """Create and return the LangGraph agent."""
+    """Create and return the LangGraph agent (compiled once per process)."""
     workflow = StateGraph(AgentState)
 
     # Add nodes
@@ -250,48 +414,105 @@ def create_agent_graph():
     workflow.add_edge("document_query", END)
     workflow.add_edge("appointment_booking", END)
 
-    # Compile the graph
+    # No checkpointer: the session store is authoritative for booking state,
+    # documents, and history. The pinned langgraph release ships no
+    # persistent saver (checkpoint.sqlite arrives in later versions).
     app = workflow.compile()
     return app
 
 
-# Create the agent
-agent_graph = create_agent_graph()
+# Create the agent at import, unless the process only needs the tools
+# (e.g. scripts can set SKIP_GRAPH_COMPILE=1 to defer compilation)
+agent_graph = None if os.environ.get("SKIP_GRAPH_COMPILE") else create_agent_graph()
 
 
-def run_agent(user_input: str, session_data: dict = None) -> dict:
-    """Run the agent with user input and session data."""
-    if session_data is None:
-        session_data = {
-            "appointment_data": {},
-            "conversation_history": [],
-            "documents_content": ""
-        }
+def get_agent_graph():
+    """Return the compiled agent graph, compiling lazily if it was skipped."""
+    global agent_graph
+    if agent_graph is None:
+        agent_graph = create_agent_graph()
+    return agent_graph
 
-    # Create initial state
-    initial_state = {
+
+def _build_initial_state(user_input: str, session_data: dict) -> dict:
+    """Build the initial graph state from user input and session data."""
+    return {
         "messages": [HumanMessage(content=user_input)],
         "user_input": user_input,
         "intent": "",
         "appointment_data": session_data.get("appointment_data", {}),
-        "conversation_history": session_data.get("conversation_history", []),
         "documents_content": session_data.get("documents_content", ""),
         "response": "",
         "next_action": ""
     }
 
-    # Run the agent
-    result = agent_graph.invoke(initial_state)
 
-    # Update session data
+def _update_session(user_input: str, session_data: dict, result: dict) -> dict:
+    """Fold a graph result back into session data and build the response dict."""
     session_data["appointment_data"] = result.get("appointment_data", {})
-    session_data["conversation_history"].append({
+
+    # Ring buffer: keep only the most recent turns so sessions stay bounded
+    history = session_data["conversation_history"]
+    history.append({
         "user": user_input,
         "assistant": result.get("response", "")
     })
+    del history[:-MAX_HISTORY_TURNS]
 
     return {
         "response": result.get("response", ""),
         "intent": result.get("intent", ""),
         "session_data": session_data
     }
+
+
+def _default_session_data() -> dict:
+    """Return an empty session data dict."""
+    return {
+        "appointment_data": {},
+        "conversation_history": [],
+        "documents_content": ""
+    }
+
+
+async def arun_agent(user_input: str, session_data: dict = None) -> dict:
+    """Run the agent asynchronously with user input and session data."""
+    if session_data is None:
+        session_data = _default_session_data()
+
+    # Run the agent without blocking the event loop
+    result = await get_agent_graph().ainvoke(
+        _build_initial_state(user_input, session_data)
+    )
+
+    return _update_session(user_input, session_data, result)
+
+
+async def arun_agent_batch(user_inputs: list, session_datas: list = None,
+                           max_concurrency: int = 8) -> list:
+    """Run the agent over a batch of inputs concurrently.
+
+    Ollama overlaps prompt processing across concurrent requests, so batching
+    collapses the per-call overhead that serial invocation would pay N times.
+    """
+    if session_datas is None:
+        session_datas = [_default_session_data() for _ in user_inputs]
+
+    initial_states = [
+        _build_initial_state(user_input, session_data)
+        for user_input, session_data in zip(user_inputs, session_datas)
+    ]
+
+    results = await get_agent_graph().abatch(
+        initial_states, config={"max_concurrency": max_concurrency}
+    )
+
+    return [
+        _update_session(user_input, session_data, result)
+        for user_input, session_data, result in zip(user_inputs, session_datas, results)
+    ]
+
+
+def run_agent(user_input: str, session_data: dict = None) -> dict:
+    """Synchronous wrapper around arun_agent for CLI scripts."""
+    return asyncio.run(arun_agent(user_input, session_data))
@@ -1,20 +1,31 @@
 """FastAPI application for context-aware chatbot."""
 
+import asyncio
+import codecs
+import json
+import logging
 import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import List, Optional, Dict, Any
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from agents import run_agent
-from config import SESSION_TIMEOUT
+from agents import arun_agent, arun_agent_batch, astream_document_answer, aclose_llm_client
+from retrieval import get_index
+from session_store import create_session_store
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Context-Aware Chatbot API",
     description="API for document queries and appointment booking",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson encodes responses in C (with native datetime support), which
+    # keeps large /sessions listings off the stdlib json path
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -26,8 +37,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory session storage (use Redis in production)
-sessions: Dict[str, Dict[str, Any]] = {}
+# Session storage: in-memory LRU by default, Redis when REDIS_URL is set
+# (Redis lets uvicorn run multiple workers without breaking session affinity)
+sessions = create_session_store()
 
 
 class ChatRequest(BaseModel):
@@ -47,34 +59,27 @@ class DocumentUploadResponse(BaseModel):
     session_id: str
 
 
-def get_or_create_session(session_id: Optional[str] = None) -> tuple[str, dict]:
+async def get_or_create_session(session_id: Optional[str] = None) -> tuple[str, dict]:
     """Get existing session or create a new one."""
-    if session_id and session_id in sessions:
-        # Update last accessed time
-        sessions[session_id]["last_accessed"] = datetime.now()
-        return session_id, sessions[session_id]
-    else:
-        # Create new session
-        new_session_id = str(uuid.uuid4())
-        sessions[new_session_id] = {
-            "appointment_data": {},
-            "conversation_history": [],
-            "documents_content": "",
-            "created_at": datetime.now(),
-            "last_accessed": datetime.now()
-        }
-        return new_session_id, sessions[new_session_id]
-
-
-def cleanup_old_sessions():
-    """Remove sessions that have exceeded timeout."""
-    current_time = datetime.now()
-    expired_sessions = [
-        sid for sid, data in sessions.items()
-        if (current_time - data["last_accessed"]).seconds > SESSION_TIMEOUT
-    ]
-    for sid in expired_sessions:
-        del sessions[sid]
+    if session_id:
+        session_data = await sessions.get(session_id)
+        if session_data is not None:
+            # Update last accessed time
+            session_data["last_accessed"] = datetime.now()
+            await sessions.save(session_id, session_data)
+            return session_id, session_data
+
+    # Create new session
+    new_session_id = str(uuid.uuid4())
+    session_data = {
+        "appointment_data": {},
+        "conversation_history": [],
+        "documents_content": "",
+        "created_at": datetime.now(),
+        "last_accessed": datetime.now()
+    }
+    await sessions.save(new_session_id, session_data)
+    return new_session_id, session_data
 
 
 @app.get("/")
@@ -100,20 +105,19 @@ async def chat(request: ChatRequest):
     """
     try:
         # Cleanup old sessions
-        cleanup_old_sessions()
+        await sessions.cleanup()
 
         # Get or create session
-        session_id, session_data = get_or_create_session(request.session_id)
+        session_id, session_data = await get_or_create_session(request.session_id)
 
-        print("chat session data", session_data)
-        print("chat session id", session_id)
+        logger.debug("chat sid=%s", session_id)
 
         # Run the agent
-        result = run_agent(request.message, session_data)
+        result = await arun_agent(request.message, session_data)
 
         # Update session
-        sessions[session_id] = result["session_data"]
-        sessions[session_id]["last_accessed"] = datetime.now()
+        result["session_data"]["last_accessed"] = datetime.now()
+        await sessions.save(session_id, result["session_data"])
 
         return ChatResponse(
             response=result["response"],
@@ -126,6 +130,70 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint for document queries.
+    Tokens are sent as server-sent events as soon as the LLM produces them,
+    so the client sees output after one token instead of the full generation.
+    """
+    # Get or create session
+    session_id, session_data = await get_or_create_session(request.session_id)
+
+    async def event_stream():
+        async for chunk in astream_document_answer(
+                request.message, session_data.get("documents_content", "")):
+            yield f"data: {json.dumps({'token': chunk})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"X-Session-ID": session_id}
+    )
+
+
+@app.post("/chat/batch", response_model=List[ChatResponse])
+async def chat_batch(requests: List[ChatRequest]):
+    """
+    Batch chat endpoint: runs all messages through the agent concurrently.
+    Useful for offline evaluation where per-request HTTP round trips would
+    otherwise serialize the Ollama calls.
+    """
+    try:
+        # Cleanup old sessions
+        await sessions.cleanup()
+
+        # Resolve a session for each request
+        session_ids = []
+        session_datas = []
+        for request in requests:
+            session_id, session_data = await get_or_create_session(request.session_id)
+            session_ids.append(session_id)
+            session_datas.append(session_data)
+
+        # Run the whole batch concurrently
+        results = await arun_agent_batch(
+            [request.message for request in requests], session_datas
+        )
+
+        responses = []
+        for session_id, result in zip(session_ids, results):
+            result["session_data"]["last_accessed"] = datetime.now()
+            await sessions.save(session_id, result["session_data"])
+            responses.append(ChatResponse(
+                response=result["response"],
+                session_id=session_id,
+                intent=result["intent"],
+                appointment_data=result["session_data"].get("appointment_data")
+            ))
+
+        return responses
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch chat: {str(e)}")
+
+
 @app.post("/upload-document", response_model=DocumentUploadResponse)
 async def upload_document(
         file: UploadFile = File(...),
@@ -137,15 +205,27 @@ async def upload_document(
     """
     try:
         # Get or create session
-        session_id, session_data = get_or_create_session(session_id)
+        session_id, session_data = await get_or_create_session(session_id)
 
-        # Read file content
-        content = await file.read()
-        text_content = content.decode("utf-8")
+        # Stream-decode the upload in 64 KiB chunks: memory stays bounded
+        # regardless of file size and invalid UTF-8 fails as soon as it appears
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="strict")
+        parts = []
+        while chunk := await file.read(65536):
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        text_content = "".join(parts)
 
         # Store in session
-        sessions[session_id]["documents_content"] = text_content
-        sessions[session_id]["last_accessed"] = datetime.now()
+        session_data["documents_content"] = text_content
+        session_data["last_accessed"] = datetime.now()
+        await sessions.save(session_id, session_data)
+
+        # Chunk and embed now so the first query pays no ingest cost
+        try:
+            await asyncio.to_thread(get_index, text_content)
+        except Exception:
+            logger.warning("Index build failed (will retry at query time)", exc_info=True)
 
         return DocumentUploadResponse(
             message=f"Document '{file.filename}' uploaded successfully. You can now ask questions about it.",
@@ -161,56 +241,63 @@ async def upload_document(
 @app.get("/sessions/{session_id}")
 async def get_session(session_id: str):
     """Get session data."""
-    if session_id not in sessions:
+    session_data = await sessions.get(session_id)
+    if session_data is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session_data = sessions[session_id]
     return {
         "session_id": session_id,
         "appointment_data": session_data.get("appointment_data", {}),
         "conversation_history": session_data.get("conversation_history", []),
         "has_documents": bool(session_data.get("documents_content", "")),
-        "created_at": session_data.get("created_at").isoformat(),
-        "last_accessed": session_data.get("last_accessed").isoformat()
+        "created_at": session_data.get("created_at"),
+        "last_accessed": session_data.get("last_accessed")
     }
 
 
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     """Delete a session."""
-    if session_id not in sessions:
+    if not await sessions.delete(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
-    del sessions[session_id]
     return {"message": "Session deleted successfully"}
 
 
 @app.get("/sessions")
 async def list_sessions():
     """List all active sessions."""
-    cleanup_old_sessions()
+    await sessions.cleanup()
+    items = await sessions.list()
     return {
-        "active_sessions": len(sessions),
+        "active_sessions": len(items),
         "sessions": [
             {
                 "session_id": sid,
-                "created_at": data["created_at"].isoformat(),
-                "last_accessed": data["last_accessed"].isoformat(),
+                "created_at": data["created_at"],
+                "last_accessed": data["last_accessed"],
                 "has_appointment": bool(data.get("appointment_data")),
                 "has_documents": bool(data.get("documents_content"))
             }
-            for sid, data in sessions.items()
+            for sid, data in items
         ]
     }
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Release the Ollama client and session store resources."""
+    await aclose_llm_client()
+    await sessions.close()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "active_sessions": len(sessions)
+        "timestamp": datetime.now(),
+        "active_sessions": await sessions.count()
     }
 
 
@@ -1,14 +1,24 @@
 """Configuration settings for the chatbot application."""
 
 # Ollama Configuration
+# Prefer a Q4_K_M-quantized tag: it halves memory traffic per weight fetch on
+# CPU inference. The default "llama3.2" tag already ships Q4_K_M; for other
+# models pick the explicit variant, e.g. "llama3.1:8b-instruct-q4_K_M".
 OLLAMA_MODEL = "llama3.2"  # Change to your preferred model (e.g., llama2, mistral)
 OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_NUM_CTX = 4096  # Context window; large enough to keep the document prefix KV-cached
 
 # Document Configuration
 DOCUMENTS_PATH = "./documents"  # Path to store documents for querying
+EMBEDDING_MODEL = "nomic-embed-text"  # Ollama model used for chunk retrieval (ollama pull nomic-embed-text)
+RETRIEVAL_TOP_K = 5  # Number of document chunks fed to the LLM per query
+MAX_DOC_CHARS = 200_000  # Document content beyond this is truncated before querying
 
 # Session Configuration
 SESSION_TIMEOUT = 3600  # Session timeout in seconds (1 hour)
+MAX_SESSIONS = 1000  # Upper bound on in-memory sessions (least recently used evicted first)
+REDIS_URL = None  # e.g. "redis://localhost:6379/0" to share sessions across uvicorn workers
+MAX_HISTORY_TURNS = 20  # Conversation turns kept per session (oldest dropped first)
 
 # Application Settings
 APP_HOST = "0.0.0.0"
@@ -1,7 +1,8 @@
 """Main test file for the context-aware chatbot."""
 
+import asyncio
 import sys
-from agents import run_agent
+from agents import run_agent, arun_agent_batch
 
 
 def print_separator():
@@ -68,11 +69,14 @@ def test_document_queries(session_data: dict):
         "What are your business hours?"
     ]
 
-    for query in test_queries:
+    # Run all queries concurrently through the batch API
+    results = asyncio.run(
+        arun_agent_batch(test_queries, [session_data] * len(test_queries))
+    )
+
+    for query, result in zip(test_queries, results):
         print(f"User: {query}")
-        result = run_agent(query, session_data)
         print_response(result)
-        session_data = result['session_data']
         print_separator()
 
     return session_data
@@ -0,0 +1,231 @@
+"""Chunked document retrieval backed by Ollama embeddings.
+
+Documents are split into ~512-character chunks and embedded once at ingest;
+queries then embed a single string and rank chunks by inner product, so
+query-time cost no longer grows with document size.
+"""
+
+import hashlib
+import re
+import threading
+
+import numpy as np
+import requests
+from cachetools import TTLCache
+
+from config import OLLAMA_BASE_URL, EMBEDDING_MODEL, RETRIEVAL_TOP_K
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Reranking is optional; retrieval order is used instead
+    CrossEncoder = None
+
+CHUNK_SIZE = 512  # characters per chunk
+RERANK_CANDIDATES = 30  # embedding hits fed to the cross-encoder
+RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
+EMBED_TIMEOUT = (5, 60)  # (connect, read) seconds for embedding calls
+
+# One session for all embedding calls: keep-alive connections are reused
+# instead of paying a TCP handshake per request
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(
+    pool_connections=10, pool_maxsize=10))
+
+# Built indexes keyed by document-content hash (process-local; rebuilt
+# lazily). Bounded so long-lived processes don't retain every distinct
+# upload's chunks and embeddings forever; evicted indexes rebuild on demand.
+# TTLCache is not thread-safe and retrieval runs in asyncio.to_thread
+# workers, so all access goes through the lock.
+_index_cache = TTLCache(maxsize=32, ttl=3600)
+_index_lock = threading.Lock()
+
+# Cross-encoder scores keyed by (query hash, chunk hash), 15-minute TTL
+_score_cache = TTLCache(maxsize=4096, ttl=900)
+_score_lock = threading.Lock()
+
+# Lazily loaded cross-encoder (model load is expensive; only pay it on use)
+_reranker = None
+
+# Quoted phrase in a query, e.g. what does "payment terms" say
+_QUOTED_RE = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+
+
+def _get_reranker():
+    """Return the shared cross-encoder, or None when unavailable."""
+    global _reranker
+    if _reranker is None and CrossEncoder is not None:
+        _reranker = CrossEncoder(RERANKER_MODEL)
+    return _reranker
+
+
+def _rerank(query: str, candidates: list, k: int) -> list:
+    """Score candidates with the cross-encoder and keep the top k.
+
+    Scores are cached per (query, chunk) pair so refined or repeated queries
+    only pay for chunks they have not seen.
+    """
+    reranker = _get_reranker()
+    if reranker is None:
+        return candidates[:k]
+
+    query_hash = hash(query)
+    scored = []
+    to_score = []
+    with _score_lock:
+        for chunk in candidates:
+            score = _score_cache.get((query_hash, hash(chunk)))
+            if score is None:
+                to_score.append(chunk)
+            else:
+                scored.append((score, chunk))
+
+    if to_score:
+        pairs = [(query, chunk) for chunk in to_score]
+        predictions = reranker.predict(pairs)
+        with _score_lock:
+            for chunk, score in zip(to_score, predictions):
+                score = float(score)
+                _score_cache[(query_hash, hash(chunk))] = score
+                scored.append((score, chunk))
+
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [chunk for _, chunk in scored[:k]]
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE) -> list:
+    """Split text into ~chunk_size-character chunks on paragraph boundaries."""
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        # Hard-split paragraphs that are longer than a whole chunk
+        while len(paragraph) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size:]
+        if paragraph:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _embed_batch(texts: list):
+    """Embed all texts in a single /api/embed call.
+
+    Returns None when the server predates the batch endpoint (or omits the
+    embeddings field), so the caller can fall back to per-item calls.
+    """
+    try:
+        response = _session.post(
+            f"{OLLAMA_BASE_URL}/api/embed",
+            json={"model": EMBEDDING_MODEL, "input": texts},
+            timeout=EMBED_TIMEOUT
+        )
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings")
+        return embeddings if embeddings and len(embeddings) == len(texts) else None
+    except requests.RequestException:
+        return None
+
+
+def _embed_one(text: str) -> list:
+    """Embed one text via the per-item /api/embeddings endpoint."""
+    response = _session.post(
+        f"{OLLAMA_BASE_URL}/api/embeddings",
+        json={"model": EMBEDDING_MODEL, "prompt": text},
+        timeout=EMBED_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()["embedding"]
+
+
+def embed_texts(texts: list) -> np.ndarray:
+    """Embed texts via the Ollama embed API, L2-normalized row-wise.
+
+    All texts go out in one batched /api/embed request (one HTTP round trip
+    instead of N); older Ollama servers fall back to per-item calls.
+    """
+    embeddings = _embed_batch(texts)
+    if embeddings is None:
+        embeddings = [_embed_one(text) for text in texts]
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    # Normalize (in fp32, for accuracy) so inner product equals cosine
+    # similarity, then store as fp16: half the memory traffic per search
+    # with negligible effect on ranking order
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix.astype(np.float16)
+
+
+class DocumentIndex:
+    """In-memory inner-product index over document chunks."""
+
+    def __init__(self, chunks: list, embeddings):
+        self.chunks = chunks
+        self.embeddings = embeddings
+
+    @classmethod
+    def from_text(cls, text: str) -> "DocumentIndex":
+        """Chunk and embed a document into a searchable index."""
+        chunks = chunk_text(text)
+        embeddings = embed_texts(chunks) if chunks else None
+        return cls(chunks, embeddings)
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> list:
+        """Return the top-k chunks for the query (retrieve, then rerank).
+
+        The embedding index proposes RERANK_CANDIDATES chunks and the
+        cross-encoder (when installed) reorders them for precision.
+        """
+        if not self.chunks:
+            return []
+
+        # Literal shortcut: a quoted phrase skips embedding and rerank
+        match = _QUOTED_RE.search(query)
+        if match:
+            phrase = (match.group(1) or match.group(2)).lower()
+            literal_hits = [chunk for chunk in self.chunks if phrase in chunk.lower()]
+            if literal_hits:
+                return literal_hits[:k]
+
+        query_emb = embed_texts([query])[0]
+        scores = (self.embeddings @ query_emb).astype(np.float32)
+        n_candidates = min(RERANK_CANDIDATES, len(self.chunks))
+        if n_candidates < len(self.chunks):
+            # argpartition is O(n) vs argsort's O(n log n); only the top
+            # slice needs ordering, and the reranker reorders it anyway
+            top_idx = np.argpartition(-scores, n_candidates)[:n_candidates]
+            top_idx = top_idx[np.argsort(-scores[top_idx])]
+        else:
+            top_idx = np.argsort(-scores)
+        candidates = [self.chunks[i] for i in top_idx]
+        return _rerank(query, candidates, k)
+
+
+def get_index(documents_content: str) -> DocumentIndex:
+    """Return the index for a document, building and caching it on first use."""
+    key = hashlib.blake2b(documents_content.encode(), digest_size=16).digest()
+    with _index_lock:
+        index = _index_cache.get(key)
+    if index is None:
+        # Build outside the lock: embedding a large document is slow and
+        # concurrent builders at worst duplicate work, not corrupt state
+        index = DocumentIndex.from_text(documents_content)
+        with _index_lock:
+            _index_cache[key] = index
+    return index
+
+
+def retrieve_relevant_info(query: str, documents_content: str,
+                           k: int = RETRIEVAL_TOP_K) -> str:
+    """Return the top-k relevant chunks joined into one prompt-ready string."""
+    chunks = get_index(documents_content).search(query, k)
+    return "\n\n".join(chunks)
@@ -0,0 +1,136 @@
+"""Session storage backends: in-memory LRU (default) and Redis (optional)."""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import SESSION_TIMEOUT, MAX_SESSIONS, REDIS_URL
+
+try:
+    import orjson
+    import redis.asyncio as aioredis
+except ImportError:  # Redis backend is optional
+    orjson = None
+    aioredis = None
+
+
+class InMemorySessionStore:
+    """LRU-ordered in-memory store. Single-process only (one dict per worker)."""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return session data or None; a hit moves the session to the LRU end."""
+        data = self._sessions.get(session_id)
+        if data is not None:
+            self._sessions.move_to_end(session_id)
+        return data
+
+    async def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Store session data and mark it most recently used."""
+        self._sessions[session_id] = data
+        self._sessions.move_to_end(session_id)
+
+    async def delete(self, session_id: str) -> bool:
+        """Delete a session; return True if it existed."""
+        return self._sessions.pop(session_id, None) is not None
+
+    async def list(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return all (session_id, data) pairs."""
+        return list(self._sessions.items())
+
+    async def cleanup(self) -> None:
+        """Evict expired sessions and enforce the session cap.
+
+        Sessions are kept in LRU order, so only the front needs checking:
+        eviction stops at the first live session (amortized O(1) per request).
+        """
+        current_time = datetime.now()
+        while self._sessions:
+            oldest_id = next(iter(self._sessions))
+            oldest = self._sessions[oldest_id]
+            expired = (current_time - oldest["last_accessed"]).seconds > SESSION_TIMEOUT
+            if expired or len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+    async def count(self) -> int:
+        """Return the number of stored sessions."""
+        return len(self._sessions)
+
+    async def close(self) -> None:
+        """Nothing to release for the in-memory store."""
+
+
+class RedisSessionStore:
+    """Redis-backed store so multiple uvicorn workers share sessions.
+
+    Expiry is delegated to Redis via SETEX, so there is no cleanup sweep at
+    all; sessions survive process restarts.
+    """
+
+    _PREFIX = "sess:"
+
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+
+    @staticmethod
+    def _loads(raw: bytes) -> Dict[str, Any]:
+        data = orjson.loads(raw)
+        # orjson encodes datetimes as ISO strings; restore them on the way out
+        for key in ("created_at", "last_accessed"):
+            if isinstance(data.get(key), str):
+                data[key] = datetime.fromisoformat(data[key])
+        return data
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return session data or None."""
+        raw = await self._redis.get(self._PREFIX + session_id)
+        return self._loads(raw) if raw is not None else None
+
+    async def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        """Store session data with the configured TTL."""
+        await self._redis.setex(
+            self._PREFIX + session_id, SESSION_TIMEOUT, orjson.dumps(data)
+        )
+
+    async def delete(self, session_id: str) -> bool:
+        """Delete a session; return True if it existed."""
+        return await self._redis.delete(self._PREFIX + session_id) > 0
+
+    async def list(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return all (session_id, data) pairs (admin/debug use)."""
+        items = []
+        async for key in self._redis.scan_iter(match=self._PREFIX + "*"):
+            raw = await self._redis.get(key)
+            if raw is not None:
+                session_id = key.decode()[len(self._PREFIX):]
+                items.append((session_id, self._loads(raw)))
+        return items
+
+    async def cleanup(self) -> None:
+        """No-op: Redis expires sessions via the SETEX TTL."""
+
+    async def count(self) -> int:
+        """Return the number of stored sessions."""
+        count = 0
+        async for _ in self._redis.scan_iter(match=self._PREFIX + "*"):
+            count += 1
+        return count
+
+    async def close(self) -> None:
+        """Close the Redis connection pool."""
+        await self._redis.aclose()
+
+
+def create_session_store():
+    """Return the Redis store when REDIS_URL is configured, else in-memory."""
+    if REDIS_URL:
+        if aioredis is None:
+            raise RuntimeError(
+                "REDIS_URL is set but the 'redis' and 'orjson' packages are not installed"
+            )
+        return RedisSessionStore(REDIS_URL)
+    return InMemorySessionStore()
@@ -1,12 +1,74 @@
 """Tool agents for validation and date extraction."""
 
+import asyncio
+import functools
+import hashlib
+import logging
 import re
+import string
+import threading
 from datetime import datetime, timedelta
 from dateutil import parser
 from email_validator import validate_email, EmailNotValidError
-from typing import Dict, Any
-from langchain_community.llms import Ollama
-from config import OLLAMA_MODEL, OLLAMA_BASE_URL
+from typing import Dict, Any, List
+import ollama
+from cachetools import TTLCache
+from config import OLLAMA_MODEL, OLLAMA_BASE_URL, OLLAMA_NUM_CTX, MAX_DOC_CHARS
+from retrieval import retrieve_relevant_info
+
+logger = logging.getLogger(__name__)
+
+# Extraction answers keyed by (normalized query, document hash), 15-minute
+# TTL so repeated questions about an unchanged document skip Ollama entirely.
+# TTLCache is not thread-safe and this one is shared between the event loop
+# and asyncio.to_thread workers, so all access goes through the lock.
+_answer_cache = TTLCache(maxsize=1024, ttl=900)
+_answer_lock = threading.Lock()
+
+# Patterns compiled once at import instead of per validation call; date
+# patterns carry re.IGNORECASE so input never needs a lowered copy first
+_IN_DAYS_RE = re.compile(r'in\s+(\d+)\s+days?', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')  # fast-reject prefilter
+
+# Single-pass C-level string machinery for the name and phone validators
+_PHONE_STRIP = str.maketrans('', '', string.whitespace + '-()+')
+_NAME_ALLOWED = frozenset(string.ascii_letters + string.whitespace + ".-'")
+_TODAY_RE = re.compile(r'^today$', re.IGNORECASE)
+_TOMORROW_RE = re.compile(r'^tomorrow$', re.IGNORECASE)
+_NEXT_WEEK_RE = re.compile(r'next\s+week', re.IGNORECASE)
+_NEXT_MONTH_RE = re.compile(r'next\s+month', re.IGNORECASE)
+_WEEKDAY_RE = re.compile(
+    r'(?:next|coming)\s+(monday|tuesday|wednesday|thursday|friday|saturday|sunday)',
+    re.IGNORECASE)
+_WEEKDAYS = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+             "friday": 4, "saturday": 5, "sunday": 6}
+
+# Explicit formats tried before falling back to dateutil's fuzzy parser;
+# ISO dates dominate form inputs and strptime is an order of magnitude faster
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%B %d %Y",
+                 "%B %d, %Y", "%d %B %Y", "%Y/%m/%d")
+
+
+def _days_to_next_weekday(target_wd: int, today_wd: int) -> int:
+    """Days until the next occurrence of target_wd (always 1-7, never 0).
+
+    Pure integer arithmetic kept free of datetime objects so bulk callers
+    could JIT-compile it (numba.njit(cache=True)) without touching the
+    parsing logic; at chat-request rates the plain Python version is faster
+    than paying numba's import and compile cost.
+    """
+    days_ahead = target_wd - today_wd
+    return days_ahead + 7 if days_ahead <= 0 else days_ahead
+
+
+def _parse_date_fallback(date_text: str) -> datetime:
+    """Parse a date string via the strptime ladder, then dateutil as last resort."""
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(date_text, fmt)
+        except ValueError:
+            continue
+    return parser.parse(date_text, fuzzy=True)
 
 
 def validate_name(name: str) -> Dict[str, Any]:
@@ -18,7 +80,7 @@ def validate_name(name: str) -> Dict[str, Any]:
         }
 
     # Check if name contains only letters, spaces, and common punctuation
-    if not re.match(r"^[a-zA-Z\s\.\-\']+$", name):
+    if not all(char in _NAME_ALLOWED for char in name):
         return {
             "valid": False,
             "error": "Name can only contain letters, spaces, and basic punctuation."
@@ -29,8 +91,8 @@ def validate_name(name: str) -> Dict[str, Any]:
 
 def validate_phone(phone: str) -> Dict[str, Any]:
     """Validate phone number format."""
-    # Remove common separators
-    cleaned_phone = re.sub(r'[\s\-\(\)\+]', '', phone)
+    # Remove common separators in one C-level pass
+    cleaned_phone = phone.translate(_PHONE_STRIP)
 
     # Check if it's numeric and has reasonable length (10-15 digits)
     if not cleaned_phone.isdigit():
@@ -49,10 +111,19 @@ def validate_phone(phone: str) -> Dict[str, Any]:
 
 
 def validate_email_address(email: str) -> Dict[str, Any]:
-    """Validate email format."""
+    """Validate email format (syntax only, no DNS lookups)."""
+    # Cheap regex prefilter: reject obvious non-emails without invoking
+    # the full validator
+    if not _EMAIL_RE.match(email):
+        return {
+            "valid": False,
+            "error": "Invalid email format: expected something like name@example.com."
+        }
+
     try:
-        # Validate email
-        valid = validate_email(email)
+        # Syntactic validation only; the default deliverability check does an
+        # MX lookup that adds network latency to every form submission
+        valid = validate_email(email, check_deliverability=False)
         return {"valid": True, "value": valid.email}
     except EmailNotValidError as e:
         return {
@@ -61,112 +132,78 @@ def validate_email_address(email: str) -> Dict[str, Any]:
         }
 
 
+@functools.lru_cache(maxsize=512)
+def _extract_date_cached(date_text: str, today_ordinal: int) -> tuple:
+    """Resolve a stripped date phrase against a given day (memoized).
+
+    Returns (value, parsed_date) or raises if the text cannot be parsed.
+    The day ordinal is part of the key so cached answers for relative
+    phrases like "tomorrow" roll over at midnight. Case handling lives in
+    the IGNORECASE patterns, so no lowered copy of the input is made.
+    """
+    today = datetime.fromordinal(today_ordinal)
+    today_wd = today.weekday()
+
+    # Handle common relative dates
+    if _TODAY_RE.match(date_text):
+        target_date = today
+    elif _TOMORROW_RE.match(date_text):
+        target_date = today + timedelta(days=1)
+    elif _NEXT_WEEK_RE.search(date_text):
+        target_date = today + timedelta(weeks=1)
+    elif _NEXT_MONTH_RE.search(date_text):
+        # Add roughly 30 days
+        target_date = today + timedelta(days=30)
+    elif (weekday_match := _WEEKDAY_RE.search(date_text)):
+        # "next <weekday>" / "coming <weekday>": one regex scan plus a
+        # dict lookup instead of a branch per weekday
+        days_ahead = _days_to_next_weekday(
+            _WEEKDAYS[weekday_match.group(1).lower()], today_wd)
+        target_date = today + timedelta(days=days_ahead)
+    elif (match := _IN_DAYS_RE.search(date_text)):
+        # Handle "in X days"
+        target_date = today + timedelta(days=int(match.group(1)))
+    else:
+        # Try explicit formats, then dateutil for anything else
+        # (strptime and dateutil both match month names case-insensitively)
+        target_date = _parse_date_fallback(date_text)
+
+    # (YYYY-MM-DD, human readable)
+    return target_date.strftime("%Y-%m-%d"), target_date.strftime("%B %d, %Y")
+
+
 def extract_date_from_natural_language(date_text: str) -> Dict[str, Any]:
     """Extract and convert natural language date to YYYY-MM-DD format."""
     try:
-        date_text_lower = date_text.lower().strip()
-        today = datetime.now()
-
-        # Handle common relative dates
-        if date_text_lower in ["today"]:
-            target_date = today
-        elif date_text_lower in ["tomorrow"]:
-            target_date = today + timedelta(days=1)
-        elif "next week" in date_text_lower:
-            target_date = today + timedelta(weeks=1)
-        elif "next month" in date_text_lower:
-            # Add roughly 30 days
-            target_date = today + timedelta(days=30)
-        elif "next monday" in date_text_lower or "coming monday" in date_text_lower:
-            days_ahead = 0 - today.weekday()  # Monday is 0
-            if days_ahead <= 0:  # Target day already happened this week
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next tuesday" in date_text_lower or "coming tuesday" in date_text_lower:
-            days_ahead = 1 - today.weekday()  # Tuesday is 1
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next wednesday" in date_text_lower or "coming wednesday" in date_text_lower:
-            days_ahead = 2 - today.weekday()  # Wednesday is 2
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next thursday" in date_text_lower or "coming thursday" in date_text_lower:
-            days_ahead = 3 - today.weekday()  # Thursday is 3
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next friday" in date_text_lower or "coming friday" in date_text_lower:
-            days_ahead = 4 - today.weekday()  # Friday is 4
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next saturday" in date_text_lower or "coming saturday" in date_text_lower:
-            days_ahead = 5 - today.weekday()  # Saturday is 5
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "next sunday" in date_text_lower or "coming sunday" in date_text_lower:
-            days_ahead = 6 - today.weekday()  # Sunday is 6
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = today + timedelta(days=days_ahead)
-        elif "in" in date_text_lower and "day" in date_text_lower:
-            # Handle "in X days"
-            match = re.search(r'in\s+(\d+)\s+days?', date_text_lower)
-            if match:
-                days = int(match.group(1))
-                target_date = today + timedelta(days=days)
-            else:
-                # Try using dateutil parser as fallback
-                target_date = parser.parse(date_text, fuzzy=True)
-        else:
-            # Try using dateutil parser for other formats
-            target_date = parser.parse(date_text, fuzzy=True)
-
-        # Format as YYYY-MM-DD
-        formatted_date = target_date.strftime("%Y-%m-%d")
-
+        formatted_date, parsed_date = _extract_date_cached(
+            date_text.strip(), datetime.now().toordinal()
+        )
         return {
             "valid": True,
             "value": formatted_date,
-            "parsed_date": target_date.strftime("%B %d, %Y")  # Human readable
+            "parsed_date": parsed_date
         }
-
-    except Exception as e:
+    except Exception:
         return {
             "valid": False,
             "error": f"Could not parse date from '{date_text}'. Please try formats like 'next Monday', 'tomorrow', 'in 3 days', or 'YYYY-MM-DD'."
         }
 
 
-def query_documents(query: str, documents_content: str = "") -> str:
-    """
-    Query documents using LLM for semantic understanding and relevance matching.
-    Uses the configured Ollama model to intelligently extract relevant information.
-    """
-    if not documents_content:
-        return "No documents available to query. Please upload documents first."
-
-    # Initialize Ollama LLM
-    try:
-        llm = Ollama(
-            model=OLLAMA_MODEL,
-            base_url=OLLAMA_BASE_URL,
-            temperature=0.3  # Lower temperature for more focused extraction
-        )
+def _build_extraction_prompt(query: str, documents_content: str) -> str:
+    """Build the semantic-extraction prompt for a query over document content.
 
-        # Create a prompt for semantic information extraction
-        extraction_prompt = f"""
-        You are an intelligent document assistant. 
+    The query goes last: everything before it is identical across turns
+    against the same document, so Ollama's prefix KV cache skips re-prefilling
+    the instructions and document content on each call.
+    """
+    return f"""
+        You are an intelligent document assistant.
         Your task is to extract and return ONLY the relevant information from the document that answers the user's query.
 
         Document Content:
         {documents_content}
-        
-        User Query: {query}
-        
+
         Instructions:
         1. Carefully read and understand the user's query
         2. Search through the entire document for information that is semantically related to the query
@@ -174,27 +211,170 @@ def query_documents(query: str, documents_content: str = "") -> str:
         4. If multiple pieces of information are relevant, include them all
         5. Preserve the original text structure and details (prices, timelines, contact info, etc.)
         6. If no relevant information is found, respond with: "No relevant information found"
-        
+
         Return only the extracted relevant information without adding explanations or commentary.
+
+        User Query: {query}
 """
 
-        # Use LLM to extract relevant information
-        relevant_info = llm.invoke(extraction_prompt).strip()
+
+def _answer_key(query: str, documents_content: str) -> tuple:
+    """Cache key for an extraction answer: normalized query + document hash."""
+    doc_hash = hashlib.blake2b(documents_content.encode(), digest_size=16).digest()
+    return query.strip().lower(), doc_hash
+
+
+def _cap_content(documents_content: str) -> str:
+    """Truncate oversized document content before any model work happens."""
+    if len(documents_content) > MAX_DOC_CHARS:
+        logger.warning("Document content truncated from %d to %d characters",
+                       len(documents_content), MAX_DOC_CHARS)
+        return documents_content[:MAX_DOC_CHARS]
+    return documents_content
+
+
+def _prefilter_content(query: str, documents_content: str) -> str:
+    """Narrow document content to the top-k chunks relevant to the query.
+
+    Keeps prompt size at O(k x chunk size) instead of O(document); falls
+    back to the full text when the embedding endpoint is unavailable.
+    """
+    try:
+        relevant = retrieve_relevant_info(query, documents_content)
+        if relevant:
+            return relevant
+    except Exception:
+        logger.warning("Chunk retrieval failed; prompting with full document",
+                       exc_info=True)
+    return documents_content
+
+
+# Async clients keyed by event loop: pooled connections are bound to the
+# loop that created them, so a process-wide client would break callers that
+# run each batch under a fresh asyncio.run loop
+_async_clients_by_loop = {}
+
+
+def _get_async_client() -> ollama.AsyncClient:
+    """Return the async Ollama client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients_by_loop.get(loop)
+    if client is None:
+        # Drop clients whose loops have closed
+        for stale in [l for l in _async_clients_by_loop if l.is_closed()]:
+            del _async_clients_by_loop[stale]
+        client = ollama.AsyncClient(host=OLLAMA_BASE_URL)
+        _async_clients_by_loop[loop] = client
+    return client
+
+
+async def query_documents_async(queries: List[str], documents_content: str = "") -> List[str]:
+    """Answer several document queries concurrently against the same content.
+
+    Uses asyncio.gather over the async Ollama client so round trips overlap
+    instead of serializing. Server-side parallelism is capped by Ollama's
+    OLLAMA_NUM_PARALLEL env var; raise it to match the expected burst size.
+    """
+    if not documents_content:
+        message = "No documents available to query. Please upload documents first."
+        return [message] * len(queries)
+
+    documents_content = _cap_content(documents_content)
+    client = _get_async_client()
+
+    async def _query_one(query: str) -> str:
+        # Empty queries cannot match anything; answer without an LLM round trip
+        if not query or not query.strip():
+            return "Please provide a query to search the documents."
+
+        cache_key = _answer_key(query, documents_content)
+        with _answer_lock:
+            cached = _answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        content = await asyncio.to_thread(_prefilter_content, query, documents_content)
+        result = await client.generate(
+            model=OLLAMA_MODEL,
+            prompt=_build_extraction_prompt(query, content),
+            options={"temperature": 0.3, "num_ctx": OLLAMA_NUM_CTX}
+        )
+        answer = result["response"].strip()
+        with _answer_lock:
+            _answer_cache[cache_key] = answer
+        return answer
+
+    return list(await asyncio.gather(*(_query_one(query) for query in queries)))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> ollama.Client:
+    """Return the shared sync Ollama client, constructed once.
+
+    Talking to Ollama directly (instead of through the langchain wrapper)
+    drops a layer of prompt/response marshalling per call and reuses one
+    keep-alive connection; the timeout bounds how long a hung server can
+    stall a request.
+    """
+    return ollama.Client(host=OLLAMA_BASE_URL, timeout=120)
+
+
+def query_documents(query: str, documents_content: str = "") -> str:
+    """
+    Query documents using LLM for semantic understanding and relevance matching.
+    Uses the configured Ollama model to intelligently extract relevant information.
+    """
+    if not documents_content:
+        return "No documents available to query. Please upload documents first."
+
+    # Empty queries cannot match anything; answer without an LLM round trip
+    if not query or not query.strip():
+        return "Please provide a query to search the documents."
+
+    documents_content = _cap_content(documents_content)
+
+    cache_key = _answer_key(query, documents_content)
+    with _answer_lock:
+        cached = _answer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        client = _get_client()
+
+        # Use LLM to extract relevant information from the retrieved chunks
+        content = _prefilter_content(query, documents_content)
+        extraction_prompt = _build_extraction_prompt(query, content)
+        result = client.generate(
+            model=OLLAMA_MODEL,
+            prompt=extraction_prompt,
+            # Lower temperature for more focused extraction
+            options={"temperature": 0.3, "num_ctx": OLLAMA_NUM_CTX}
+        )
+        relevant_info = result["response"].strip()
 
         # Check if information was found
         if "no relevant information found" in relevant_info.lower() and len(relevant_info) < 100:
-            return "No relevant information found in the documents for your query."
+            relevant_info = "No relevant information found in the documents for your query."
 
+        with _answer_lock:
+            _answer_cache[cache_key] = relevant_info
         return relevant_info
 
-    except Exception as e:
+    except Exception:
         # Fallback to keyword-based search if LLM fails
-        print(f"LLM query failed, falling back to keyword search: {e}")
-        query_lower = query.lower()
-        lines = documents_content.split('\n')
-        relevant_lines = [line for line in lines if any(word in line.lower() for word in query_lower.split())]
+        logger.warning("LLM query failed, falling back to keyword search", exc_info=True)
+        query_tokens = set(query.lower().split())
+        relevant_lines = []
+        # Single pass with a token-set disjointness test per line, stopping
+        # at 5 hits since only the first five are returned anyway
+        for line in documents_content.splitlines():
+            if not query_tokens.isdisjoint(line.lower().split()):
+                relevant_lines.append(line)
+                if len(relevant_lines) == 5:
+                    break
 
         if relevant_lines:
-            return "\n".join(relevant_lines[:5])
+            return "\n".join(relevant_lines)
         else:
             return "No relevant information found in the documents for your query."
\ No newline at end of file